@@ -1,125 +1,244 @@
 import streamlit as st
 import json
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 import os
 import re
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from types import MappingProxyType
+import numpy as np
 import pandas as pd
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
+from grocery_store import GroceryStore, cached_until_save
 
 # Load environment variables
 load_dotenv()
 
-# ========== BACKEND ASSISTANT CLASS ==========
-class GroceryAssistant:
-    def __init__(self, use_llm=False, api_key=""):
-        self.filename = "grocery_data.json"
-        self.use_llm = use_llm
-        self.api_key = api_key
-        self.model = None
-        self.model_name = "Unknown"
-        self.last_error = None  # Store errors to show in UI
-
-        # --- CONFIGURE GEMINI (AUTO-DETECT MODE) ---
-        if self.use_llm and self.api_key:
-            try:
-                genai.configure(api_key=self.api_key)
-                
-                # 1. Ask Google what models are available for this Key
-                all_models = list(genai.list_models())
-                
-                # 2. Find models that can generate text (generateContent)
-                valid_models = [m.name for m in all_models if 'generateContent' in m.supported_generation_methods]
-                
-                if not valid_models:
-                    self.last_error = "No compatible models found for this Key."
-                else:
-                    # 3. Smart Selection: Prefer Flash -> Pro -> 1.0 -> Any
-                    preferred_order = [
-                        'models/gemini-1.5-flash', 
-                        'models/gemini-pro', 
-                        'models/gemini-1.0-pro',
-                        'models/gemini-1.5-pro'
-                    ]
-                    
-                    selected_model = valid_models[0] # Default to first one found
-                    
-                    # Try to find a preferred model
-                    for p in preferred_order:
-                        if p in valid_models:
-                            selected_model = p
-                            break
-                    
-                    self.model_name = selected_model
-                    self.model = genai.GenerativeModel(selected_model)
-                    
-            except Exception as e:
-                self.last_error = f"Setup Error: {str(e)}"
-                print(f"Gemini Setup Error: {e}")
-
-        self.load_data()
-        
-        # Default knowledge base
-        self.default_expiry_days = {
-            "milk": 7, "eggs": 14, "bread": 5, "cheese": 10,
-            "yogurt": 10, "meat": 3, "fish": 2, "vegetables": 7, "fruits": 5
-        }
-        
-        if "learned_expiry" not in self.data:
-            self.data["learned_expiry"] = {}
+WEEK_SECONDS = 7 * 24 * 3600
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+INT_RE = re.compile(r'-?\d+')
 
-        self.expiry_map = {**self.default_expiry_days, **self.data["learned_expiry"]}
+# Smart Selection: Prefer current Flash models -> Any (kept short; each miss is a round trip)
+PREFERRED_MODELS = [
+    'models/gemini-2.5-flash', 
+    'models/gemini-2.0-flash'
+]
 
-        self.healthier_options = {
-            "white bread": "whole wheat bread 🍞", "soda": "sparkling water 💧",
-            "chips": "air-popped popcorn 🌰", "sugar": "honey 🍯",
-            "butter": "olive oil 🥑", "white rice": "brown rice 🍚",
-            "milk chocolate": "dark chocolate 🍫", "ice cream": "frozen yogurt 🍨",
-            "mayonnaise": "greek yogurt 🥣"
-        }
-        
-        self.item_pairings = {
-            "bread": ["butter", "jam"], "coffee": ["milk", "sugar"],
-            "pasta": ["pasta sauce", "cheese"], "eggs": ["bread", "butter"],
-            "cereal": ["milk"], "pancake": ["syrup"],
-        }
+# ========== GEMINI MODEL SELECTION ==========
+@st.cache_resource(show_spinner=False)
+def gemini_clients(api_key):
+    """(model, generative) service clients that carry this key themselves, instead of reading the
+    process-wide genai.configure() that a concurrent session with another key could overwrite."""
+    options = {"api_key": api_key}
+    return glm.ModelServiceClient(client_options=options), glm.GenerativeServiceClient(client_options=options)
 
-    def load_data(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r') as f:
-                    self.data = json.load(f)
-            except:
-                self.data = self.default_data()
-        else:
-            self.data = self.default_data()
-    
-    def default_data(self):
-        return {
-            "grocery_list": [], "purchase_history": [], "last_purchase": {},
-            "learned_expiry": {}, "user_preferences": {"diet": "None"}
-        }
+@st.cache_data(ttl=3600, show_spinner=False)
+def select_model_name(api_key):
+    """Returns the first usable preferred model for this key, or any text model, or None."""
+    model_client = gemini_clients(api_key)[0]
     
-    def save_data(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4, default=str)
+    # 1. Probe the preferred models directly (one small request, usually the first hit)
+    for name in PREFERRED_MODELS:
+        try:
+            if 'generateContent' in genai.get_model(name, client=model_client).supported_generation_methods:
+                return name
+        except google_exceptions.GoogleAPICallError:
+            continue  # Missing, retired or not allowed for this Key
     
+    # 2. Fall back to the full catalog only if none of them exist for this Key
+    valid_models = [m.name for m in genai.list_models(client=model_client) if 'generateContent' in m.supported_generation_methods]
+    return valid_models[0] if valid_models else None
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_gemini_model(api_key):
+    """GenerativeModel for the best model this key can use, or None; shared by every session on the key."""
+    name = select_model_name(api_key)
+    if not name: return None
+    model = genai.GenerativeModel(name)
+    model._client = gemini_clients(api_key)[1]  # GenerativeModel takes no client argument
+    return model
+
+# ========== GEMINI RESPONSE CACHE ==========
+class PromptCache:
+    """SQLite-backed store of Gemini responses keyed by a hash of model + prompt,
+    fronted by a small in-memory LRU so hot prompts skip the database too."""
+    def __init__(self, filename="gemini_cache.db", memory_size=256):
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # hash -> (response, ts), most recently used last
+        self.memory_size = memory_size
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, response TEXT, ts REAL)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}|{prompt}".encode()).hexdigest()
+
+    def get(self, key, ttl=None):
+        """Returns the cached response, or None if missing or older than ttl seconds (None = never expires)."""
+        min_ts = time.time() - ttl if ttl is not None else 0
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit is None:
+                hit = self.conn.execute("SELECT response, ts FROM cache WHERE hash=?", (key,)).fetchone()
+                if hit is None: return None
+                self._remember(key, hit)
+            else:
+                self.memory.move_to_end(key)
+        return hit[0] if hit[1] > min_ts else None
+
+    def set(self, key, response):
+        entry = (response, time.time())
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, *entry))
+            self.conn.commit()
+            self._remember(key, entry)
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+# ========== PER-SESSION GEMINI SETTINGS ==========
+class GeminiSession:
+    """One browser session's AI settings, model and last error. Lives in st.session_state, apart
+    from the process-wide GroceryAssistant, so concurrent sessions never share a key or an error."""
+    def __init__(self, cache):
+        self.cache = cache
+        self.use_llm = False
+        self.api_key = ""
+        self.model = None
+        self.model_name = "Unknown"
+        self._settings = None  # (use_llm, api_key) the model was last set up for
+        self.last_error = None  # Store errors to show in UI
+
+    # --- CONFIGURE GEMINI (AUTO-DETECT MODE) ---
+    def configure(self, use_llm, api_key):
+        """Applies the sidebar settings. Setup only runs when they change, so a failure is reported
+        once and Clear Error sticks; re-enabling AI or changing the key tries again."""
+        if (use_llm, api_key) == self._settings:
+            return
+        self._settings = (use_llm, api_key)
+        self.use_llm = use_llm
+        self.api_key = api_key
+        self.model, self.model_name = None, "Unknown"
+        if not (use_llm and api_key):
+            return
+        try:
+            # Pick a model for this Key (a key with none stays None for the hour too)
+            self.model = get_gemini_model(api_key)
+            if not self.model:
+                self.last_error = "No compatible models found for this Key."
+            else:
+                self.model_name = self.model.model_name
+        except Exception as e:
+            self.model = None
+            self.last_error = f"Setup Error: {str(e)}"
+            print(f"Gemini Setup Error: {e}")
+
     # --- GEMINI HELPER ---
-    def ask_gemini(self, prompt):
+    # cache_ttl: 0 = always call Gemini, None = cache forever, N = reuse answers up to N seconds old
+    def ask_gemini(self, prompt, cache_ttl=0):
         if not self.model: 
             return None
+        key = PromptCache.key(self.model_name, prompt)
+        if cache_ttl != 0:
+            cached = self.cache.get(key, cache_ttl)
+            if cached is not None:
+                return cached
         try:
             response = self.model.generate_content(prompt)
             if not response.parts:
                 return "⚠️ AI Response Blocked (Safety)"
-            return response.text.strip()
+            text = response.text.strip()
+            if cache_ttl != 0:
+                self.cache.set(key, text)
+            return text
         except Exception as e:
             self.last_error = str(e)
             return None
 
+    def ask_gemini_stream(self, prompt, cache_ttl=0):
+        """Yields response text as Gemini generates it. Cached answers come back in one piece."""
+        if not self.model:
+            yield "⚠️ Enable AI first."
+            return
+        key = PromptCache.key(self.model_name, prompt)
+        if cache_ttl != 0:
+            cached = self.cache.get(key, cache_ttl)
+            if cached is not None:
+                yield cached
+                return
+        try:
+            parts = []
+            for chunk in self.model.generate_content(prompt, stream=True):
+                if not chunk.parts: continue
+                parts.append(chunk.text)
+                yield chunk.text
+            if not parts:
+                yield "⚠️ AI Response Blocked (Safety)"
+            elif cache_ttl != 0:
+                self.cache.set(key, "".join(parts).strip())
+        except Exception as e:
+            self.last_error = str(e)
+            yield f"⚠️ AI Error: {self.last_error}"
+
+# ========== BACKEND ASSISTANT CLASS ==========
+class GroceryAssistant(GroceryStore):
+    # Default knowledge base: read-only class data shared by every instance
+    default_expiry_days = MappingProxyType({
+        "milk": 7, "eggs": 14, "bread": 5, "cheese": 10,
+        "yogurt": 10, "meat": 3, "fish": 2, "vegetables": 7, "fruits": 5
+    })
+
+    healthier_options = MappingProxyType({
+        "white bread": "whole wheat bread 🍞", "soda": "sparkling water 💧",
+        "chips": "air-popped popcorn 🌰", "sugar": "honey 🍯",
+        "butter": "olive oil 🥑", "white rice": "brown rice 🍚",
+        "milk chocolate": "dark chocolate 🍫", "ice cream": "frozen yogurt 🍨",
+        "mayonnaise": "greek yogurt 🥣"
+    })
+    
+    item_pairings = MappingProxyType({
+        "bread": ("butter", "jam"), "coffee": ("milk", "sugar"),
+        "pasta": ("pasta sauce", "cheese"), "eggs": ("bread", "butter"),
+        "cereal": ("milk",), "pancake": ("syrup",),
+    })
+
+    def __init__(self):
+        super().__init__()
+        
+        if "learned_expiry" not in self.data:
+            self.data["learned_expiry"] = {}
+
+    @cached_property
+    def expiry_map(self):
+        """Defaults overlaid with learned shelf lives; dropped from __dict__ when learned_expiry changes."""
+        return {**self.default_expiry_days, **self.data["learned_expiry"]}
+
+    def default_data(self):
+        return {
+            "grocery_list": [], "purchase_history": [], "last_purchase": {},
+            "learned_expiry": {}, "user_preferences": {"diet": "None"}
+        }
+
+    def reset_data(self):
+        """Clears all state, including the purchase log and anything learned about shelf lives."""
+        with self.transaction():
+            super().reset_data()
+            self.__dict__.pop("expiry_map", None)
+
     # --- FEATURE: LAZY LEARNING EXPIRY ---
-    def get_ai_expiry(self, item_name):
-        if not self.model: return (7, "Default (No AI)")
+    def get_ai_expiry(self, ai, item_name):
+        if not ai or not ai.model: return (7, "Default (No AI)")
         
         prompt = (
             f"Analyze '{item_name}'. 1. Is it perishable food? "
@@ -127,30 +246,31 @@ class GroceryAssistant:
             "3. If YES, return average fridge shelf life in days. "
             "Return ONLY the integer."
         )
-        res = self.ask_gemini(prompt)
+        res = ai.ask_gemini(prompt, cache_ttl=None)  # Shelf life doesn't change
         
         if not res or "⚠️" in res:
             return (7, "Default (AI Error)")
 
-        nums = re.findall(r'-?\d+', res)
-        if nums: 
-            return (int(nums[0]), "Gemini AI")
+        m = INT_RE.search(res)
+        if m: 
+            return (int(m.group(0)), "Gemini AI")
             
         return (7, "Default (Parse Error)")
 
-    def record_purchase(self, item, quantity=1):
+    def record_purchase(self, item, quantity=1, ai=None):
         item = item.strip().lower()
-        today = datetime.now().strftime("%Y-%m-%d")
+        today_date = date.today()
+        today = today_date.isoformat()
         
-        if item in self.expiry_map:
-            days = self.expiry_map[item]
+        days = self.expiry_map.get(item)
+        if days is not None:
             source = "Memory"
         else:
-            days, status = self.get_ai_expiry(item)
+            days, status = self.get_ai_expiry(ai, item)
             
             if "Gemini AI" in status and days > 0:
                 self.data["learned_expiry"][item] = days
-                self.expiry_map[item] = days
+                self.__dict__.pop("expiry_map", None)
                 source = "Gemini AI"
             else:
                 source = status 
@@ -159,46 +279,73 @@ class GroceryAssistant:
             expiry_date = "N/A (Non-perishable)"
             disp_days = "Infinite"
         else:
-            expiry_date = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+            expiry_date = (today_date + timedelta(days=days)).isoformat()
             disp_days = f"{days} days"
         
-        self.data["purchase_history"].append({
+        history_df = self.history_df
+        entry = {
             "item": item, "quantity": quantity, "purchase_date": today,
             "expiry_date": expiry_date, "expiry_source": source
-        })
-        self.data["last_purchase"][item] = today
-        if item in self.data["grocery_list"]: self.data["grocery_list"].remove(item)
-        self.save_data()
+        }
+        with self.transaction():
+            self.append_history(entry)
+            self.data["last_purchase"][item] = today
+            self.discard_item(item)
+            self.extend_history_df(history_df, entry)
         
         return f"🛍️ Purchased {quantity}x {item.title()} (Expires: {disp_days} via {source})"
 
-    def check_dietary_safety(self, item):
+    def analyze_item(self, ai, item):
+        """Diet check and add advice in one Gemini call. Returns a dict or None on failure."""
         user_diet = self.data["user_preferences"].get("diet", "None")
-        if user_diet == "None": return None
-        prompt = f"I follow a {user_diet} diet. Is '{item}' allowed? Answer 'YES' or 'NO' followed by a 5 word reason."
-        return self.ask_gemini(prompt)
+        prompt = (
+            'Return strict JSON: {"diet_ok": bool, "diet_reason": str (max 5 words), "add_thought": str (1 short sentence)}. '
+            f"Diet={user_diet}. Item='{item}'. add_thought answers: should I add it to a grocery list?"
+        )
+        res = ai.ask_gemini(prompt, cache_ttl=WEEK_SECONDS)
+        if not res or "⚠️" in res: return None
+        
+        # Gemini often wraps JSON in markdown fences, so pull out the object itself
+        match = JSON_OBJECT_RE.search(res)
+        try:
+            analysis = json.loads(match.group(0) if match else res)
+        except ValueError:
+            ai.last_error = f"Could not parse AI analysis: {res[:80]}"
+            return None
+        return analysis if isinstance(analysis, dict) else None
 
-    def add_item(self, item):
+    def add_item(self, item, ai=None):
         item = item.strip().lower()
         if not item: return "❌ Enter name"
-        if item in self.data["grocery_list"]: return f"⚠️ Already on list!"
+        if item in self.list_index: return f"⚠️ Already on list!"
         
         warnings = ""
         ai_thought = ""
 
-        if self.use_llm and self.model:
-            diet_check = self.check_dietary_safety(item)
-            if diet_check and "NO" in diet_check.upper():
-                warnings = f"\n\n🚨 **Dietary Warning:** {diet_check}"
-            elif diet_check is None and self.last_error:
-                 warnings = f"\n\n⚠️ **AI Error:** Could not check diet."
-            
-            ai_thought = self.ask_gemini(f"Should I add {item} to a grocery list? Answer in 1 short sentence.")
-            if not ai_thought: ai_thought = "⚠️ AI Unavailable."
+        has_diet = self.data["user_preferences"].get("diet", "None") != "None"
+        known_item = item in self.expiry_map or item in self.item_pairings
+        llm = ai is not None and ai.use_llm and ai.model is not None
+
+        if llm and known_item and not has_diet:
+            # Nothing for Gemini to decide on a familiar grocery with no diet to check
+            days = self.expiry_map.get(item)
+            ai_thought = f"✅ Common grocery item ({days}-day shelf life)." if days else "✅ Common grocery item."
+        elif llm:
+            analysis = self.analyze_item(ai, item)
+            if analysis is None:
+                if has_diet and ai.last_error:
+                    warnings = f"\n\n⚠️ **AI Error:** Could not check diet."
+                ai_thought = "⚠️ AI Unavailable."
+            else:
+                # Models sometimes answer "false"/"NO" as a string instead of a JSON bool
+                if has_diet and str(analysis.get("diet_ok")).strip().lower() in ("false", "no", "0"):
+                    warnings = f"\n\n🚨 **Dietary Warning:** NO, {analysis.get('diet_reason', 'not allowed')}"
+                ai_thought = analysis.get("add_thought") or "⚠️ AI Unavailable."
         else:
             ai_thought = "🤖 Using rule-based reasoning..."
         
         self.data["grocery_list"].append(item)
+        self._list_index[item] = item
         self.save_data()
         
         suggestions = []
@@ -207,50 +354,101 @@ class GroceryAssistant:
         
         return f"✅ Added {item.title()}!\n\n**AI Analysis:** {ai_thought}{warnings}\n\n" + "\n".join(suggestions)
 
-    def generate_recipes(self):
-        if not self.model: return "⚠️ Enable AI first."
-        ingredients = self.data['grocery_list'] + [p['item'] for p in self.data['purchase_history'][-10:]]
-        if not ingredients: return "Kitchen empty!"
+    # stream=True returns an iterator of text chunks for st.write_stream instead of a string
+    def generate_recipes(self, ai, stream=False):
+        if not ai.model: return iter(["⚠️ Enable AI first."]) if stream else "⚠️ Enable AI first."
+        # Up to 10 most recent distinct purchases, walking back only as far as needed
+        recent = {}
+        for p in reversed(self.data['purchase_history']):
+            recent[p['item']] = None
+            if len(recent) >= 10: break
+        ingredients = list(dict.fromkeys(self.data['grocery_list'] + list(recent)))
+        if not ingredients: return iter(["Kitchen empty!"]) if stream else "Kitchen empty!"
         
-        prompt = f"I have: {', '.join(set(ingredients))}. Suggest 3 simple recipes. Format with emojis."
-        res = self.ask_gemini(prompt)
-        return res if res else f"⚠️ AI Error: {self.last_error}"
+        prompt = f"I have: {', '.join(ingredients)}. Suggest 3 simple recipes. Format with emojis."
+        if stream: return ai.ask_gemini_stream(prompt)
+        res = ai.ask_gemini(prompt)
+        return res if res else f"⚠️ AI Error: {ai.last_error}"
 
-    def categorize_list(self):
-        if not self.data['grocery_list']: return "List empty."
+    def categorize_list(self, ai, stream=False):
+        if not self.data['grocery_list']: return iter(["List empty."]) if stream else "List empty."
         prompt = f"Sort these into store aisles (Produce, Dairy, etc): {', '.join(self.data['grocery_list'])}. Return a clean list."
-        res = self.ask_gemini(prompt)
-        return res if res else f"⚠️ AI Error: {self.last_error}"
+        if stream: return ai.ask_gemini_stream(prompt, cache_ttl=WEEK_SECONDS)
+        res = ai.ask_gemini(prompt, cache_ttl=WEEK_SECONDS)
+        return res if res else f"⚠️ AI Error: {ai.last_error}"
 
+    @cached_until_save
     def check_restock_needs(self):
-        suggs = []
-        today = datetime.now()
-        for item, last in self.data["last_purchase"].items():
-            if item in self.data["grocery_list"]: continue
-            try:
-                days = (today - datetime.strptime(last, "%Y-%m-%d")).days
-                freq = self.expiry_map.get(item, 7)
-                if days >= freq: suggs.append(f"🔄 **{item.title()}**: Bought {days} days ago.")
-            except: continue
-        return suggs
+        last = pd.Series(self.data["last_purchase"], dtype=object)
+        if last.empty: return []
+        # Unparseable dates become NaT, so their NaN day counts fail every comparison
+        days = (pd.Timestamp.now() - pd.to_datetime(last, format="%Y-%m-%d", errors="coerce")).dt.days
+        freq = pd.Series(self.expiry_map, dtype=float).reindex(last.index).fillna(7)
+        due = (days >= freq) & ~last.index.isin(list(self.list_index))
+        return [f"🔄 **{item.title()}**: Bought {int(d)} days ago." for item, d in days[due].items()]
 
+    @cached_until_save
+    def inventory_df(self):
+        """Display columns of history_df; rows logged by the rule-based app have no expiry_source."""
+        return self.history_df.reindex(columns=["item", "quantity", "purchase_date", "expiry_date", "expiry_source"])
+
+    @cached_until_save
     def get_expiry_alerts(self):
-        alerts = []
-        today = datetime.now()
-        for p in self.data["purchase_history"]:
-            if "expiry_date" in p and p["expiry_date"] != "N/A (Non-perishable)":
-                try:
-                    left = (datetime.strptime(p["expiry_date"], "%Y-%m-%d") - today).days
-                    if left < 0 and left > -30: alerts.append(f"❌ **{p['item']}** expired!")
-                    elif 0 <= left <= 2: alerts.append(f"⚠️ **{p['item']}** expires soon!")
-                except: continue
-        return alerts
+        df = self.history_df
+        if df.empty: return []
+        # "N/A (Non-perishable)" and malformed dates are NaT and drop out of both masks
+        left = (self.history_expiry - pd.Timestamp.now()).dt.days.to_numpy()
+        expired = (left < 0) & (left > -30)
+        soon = (left >= 0) & (left <= 2)
+        items = df["item"].to_numpy()
+        return [f"❌ **{items[i]}** expired!" if expired[i] else f"⚠️ **{items[i]}** expires soon!"
+                for i in np.flatnonzero(expired | soon)]
+
+@st.cache_resource(show_spinner=False)
+def get_assistant() -> GroceryAssistant:
+    """Builds the assistant once per process; it is the only owner of grocery_data.json."""
+    return GroceryAssistant()
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_cache() -> PromptCache:
+    """One Gemini response cache per process, shared by every session's GeminiSession."""
+    return PromptCache()
 
 # ========== STREAMLIT APP ==========
+APP_CSS = """<style>.main-header {font-size: 2.5rem; color: #2E86AB; text-align: center;} 
+    .stButton>button {width: 100%; border-radius: 10px;}</style>"""
+
+# Button callbacks run before the rerun the click triggers, so no extra st.rerun() is needed
+def remove_from_list(assistant, item):
+    before = assistant.check_restock_needs()
+    with assistant.transaction():
+        assistant.discard_item(item)
+    # Smart Predictions sit outside the list fragment; ask it for a full rerun only if they changed
+    st.session_state.restock_stale = assistant.check_restock_needs() != before
+
+def add_to_list(assistant, item, ai):
+    assistant.add_item(item, ai)
+
+def reset_system():
+    if 'assistant' in st.session_state:
+        st.session_state.assistant.reset_data()
+
+def clear_error():
+    st.session_state.gemini.last_error = None
+
+@st.fragment
+def render_grocery_list(assistant):
+    """Remove buttons rerun only this fragment, unless the change also affects Smart Predictions."""
+    if st.session_state.pop("restock_stale", False):
+        st.rerun()
+    st.header(f"📋 List ({len(assistant.data['grocery_list'])})")
+    for i, item in enumerate(assistant.data["grocery_list"], 1):
+        with st.expander(f"{i}. {item.title()}"):
+            st.button("Remove", key=f"del_{item}", on_click=remove_from_list, args=(assistant, item))
+
 def main():
     st.set_page_config(page_title="Smart Grocery AI", page_icon="🛒", layout="wide")
-    st.markdown("""<style>.main-header {font-size: 2.5rem; color: #2E86AB; text-align: center;} 
-    .stButton>button {width: 100%; border-radius: 10px;}</style>""", unsafe_allow_html=True)
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     st.markdown("<h1 class='main-header'>🤖 AI Grocery Assistant</h1>", unsafe_allow_html=True)
     
     # --- SETUP ---
@@ -269,17 +467,17 @@ def main():
         # --- CONNECTION TESTER ---
         if use_llm:
             if st.button("📡 Test AI Connection"):
-                if 'assistant' in st.session_state:
-                    assistant = st.session_state.assistant
-                    if assistant.model:
-                        with st.spinner(f"Testing {assistant.model_name}..."):
-                            test_res = assistant.ask_gemini("Say 'Hello' in 1 word.")
+                if 'gemini' in st.session_state:
+                    gemini = st.session_state.gemini
+                    if gemini.model:
+                        with st.spinner(f"Testing {gemini.model_name}..."):
+                            test_res = gemini.ask_gemini("Say 'Hello' in 1 word.")
                             if test_res and "⚠️" not in test_res:
-                                st.success(f"Connected to {assistant.model_name}!")
+                                st.success(f"Connected to {gemini.model_name}!")
                             else:
-                                st.error(f"Failed: {assistant.last_error}")
+                                st.error(f"Failed: {gemini.last_error}")
                     else:
-                         st.error(f"No Model Found: {assistant.last_error}")
+                         st.error(f"No Model Found: {gemini.last_error}")
                 else:
                     st.warning("Initialize app first.")
 
@@ -295,29 +493,19 @@ def main():
                 st.success(f"Saved: {diet_choice}")
 
         st.divider()
-        if st.button("🔄 Reset System"):
-            if 'assistant' in st.session_state:
-                st.session_state.assistant.data = st.session_state.assistant.default_data()
-                st.session_state.assistant.save_data()
-                st.rerun()
+        st.button("🔄 Reset System", on_click=reset_system)
 
-    if 'assistant' not in st.session_state:
-        st.session_state.assistant = GroceryAssistant(use_llm=use_llm, api_key=api_key)
-    
-    # Refresh settings
-    st.session_state.assistant.use_llm = use_llm
-    st.session_state.assistant.api_key = api_key
-    # Re-trigger setup if key changes
-    if use_llm and api_key and not st.session_state.assistant.model:
-        st.session_state.assistant = GroceryAssistant(use_llm=use_llm, api_key=api_key)
+    st.session_state.assistant = get_assistant()
+    # Key, model and errors are per session; the data behind them is shared by every session
+    if 'gemini' not in st.session_state:
+        st.session_state.gemini = GeminiSession(get_prompt_cache())
+    st.session_state.gemini.configure(use_llm, api_key)
 
     # --- ERROR DISPLAY ---
-    if st.session_state.assistant.last_error:
-        st.error(f"🛑 AI Error: {st.session_state.assistant.last_error}")
-        st.caption("Common fixes: Run 'pip install --upgrade google-generativeai', check Key quota, or restart app.")
-        if st.button("Clear Error"):
-            st.session_state.assistant.last_error = None
-            st.rerun()
+    if st.session_state.gemini.last_error:
+        st.error(f"🛑 AI Error: {st.session_state.gemini.last_error}")
+        st.caption("Common fixes: Run 'pip install --upgrade google-generativeai', check Key quota, or untick and re-tick Enable AI Features to retry.")
+        st.button("Clear Error", on_click=clear_error)
 
     col1, col2 = st.columns([2, 1])
 
@@ -328,9 +516,7 @@ def main():
             for s in suggs:
                 c1, c2 = st.columns([4,1])
                 c1.info(s)
-                if c2.button("Add", key=s): 
-                    st.session_state.assistant.add_item(s.split("**")[1])
-                    st.rerun()
+                c2.button("Add", key=s, on_click=add_to_list, args=(st.session_state.assistant, s.split("**")[1], st.session_state.gemini))
         else: st.caption("✅ No restocks needed.")
         
         st.divider()
@@ -338,7 +524,7 @@ def main():
         with st.form("add"):
             new_item = st.text_input("Item:")
             if st.form_submit_button("➕ Add"):
-                res = st.session_state.assistant.add_item(new_item)
+                res = st.session_state.assistant.add_item(new_item, st.session_state.gemini)
                 st.info(res)
         
         st.divider()
@@ -347,19 +533,13 @@ def main():
         with ac1:
             if st.button("🥦 Categorize List"):
                 with st.spinner("Sorting..."):
-                    st.info(st.session_state.assistant.categorize_list())
+                    st.write_stream(st.session_state.assistant.categorize_list(st.session_state.gemini, stream=True))
         with ac2:
             if st.button("🍳 Suggest Recipes"):
                 with st.spinner("Cooking ideas..."):
-                    st.success(st.session_state.assistant.generate_recipes())
-
-        st.header(f"📋 List ({len(st.session_state.assistant.data['grocery_list'])})")
-        for i, item in enumerate(st.session_state.assistant.data["grocery_list"], 1):
-            with st.expander(f"{i}. {item.title()}"):
-                if st.button("Remove", key=f"del_{item}"):
-                    st.session_state.assistant.data["grocery_list"].remove(item)
-                    st.session_state.assistant.save_data()
-                    st.rerun()
+                    st.write_stream(st.session_state.assistant.generate_recipes(st.session_state.gemini, stream=True))
+
+        render_grocery_list(st.session_state.assistant)
 
     with col2:
         st.header("🛍️ Record Purchase")
@@ -368,7 +548,7 @@ def main():
             p_qty = st.number_input("Qty:", 1)
             if st.form_submit_button("✓ Record"):
                 with st.spinner("🧠 AI Checking..."):
-                    res = st.session_state.assistant.record_purchase(p_item, p_qty)
+                    res = st.session_state.assistant.record_purchase(p_item, p_qty, st.session_state.gemini)
                     st.session_state['last_msg'] = res
                     st.rerun()
         
@@ -386,8 +566,7 @@ def main():
     with st.expander("📦 Full Inventory", expanded=True):
         hist = st.session_state.assistant.data["purchase_history"]
         if hist:
-            df = pd.DataFrame(hist)[["item", "quantity", "purchase_date", "expiry_date", "expiry_source"]]
-            st.dataframe(df, use_container_width=True)
+            st.dataframe(st.session_state.assistant.inventory_df(), use_container_width=True)
         else: st.info("Inventory empty.")
 
 if __name__ == "__main__":
@@ -1,90 +1,96 @@
 import streamlit as st
-import json
-from datetime import datetime, timedelta
-import os
+from datetime import date, timedelta
+import re
+import numpy as np
 import pandas as pd
-import time
+from types import MappingProxyType
+from grocery_store import GroceryStore, cached_until_save
+
+def keyword_matcher(keys):
+    """Returns match(text) -> the first rule keyword, in rule order, found anywhere in text (or None).
+    One regex pass; the lookahead also reports keywords that overlap another match."""
+    pat = re.compile("(?=(" + "|".join(re.escape(k) for k in keys) + "))")
+    rank = {k: i for i, k in enumerate(keys)}
+    def match(text):
+        return min((m.group(1) for m in pat.finditer(text)), key=rank.__getitem__, default=None)
+    return match
 
 # ========== BACKEND LOGIC (RULE-BASED AGENT) ==========
-class GroceryAssistant:
-    def __init__(self):
-        self.filename = "grocery_data.json"
-        self.load_data()
-        
-        # --- RULE 1: SHELF LIFE ---
-        self.shelf_life_rules = {
-            "milk": 7, "eggs": 14, "bread": 5, "cheese": 14,
-            "yogurt": 7, "chicken": 3, "beef": 3, "fish": 2,
-            "rice": 30, "pasta": 30, "apples": 10, "bananas": 4,
-            "shampoo": 30, "soap": 14, "toothpaste": 30,
-            "default": 7
-        }
+class GroceryAssistant(GroceryStore):
+    # Rules are read-only class data shared by every instance; patterns compile once at import
+    
+    # --- RULE 1: SHELF LIFE ---
+    shelf_life_rules = MappingProxyType({
+        "milk": 7, "eggs": 14, "bread": 5, "cheese": 14,
+        "yogurt": 7, "chicken": 3, "beef": 3, "fish": 2,
+        "rice": 30, "pasta": 30, "apples": 10, "bananas": 4,
+        "shampoo": 30, "soap": 14, "toothpaste": 30,
+        "default": 7
+    })
+    _shelf_life_match = staticmethod(keyword_matcher(shelf_life_rules))
 
-        # --- RULE 2: HEALTHIER ALTERNATIVES ---
-        self.healthier_options = {
-            "white bread": "Whole Wheat Bread 🍞",
-            "soda": "Sparkling Water 💧",
-            "coke": "Sparkling Water 💧",
-            "pepsi": "Sparkling Water 💧",
-            "chips": "Popcorn 🍿",
-            "crisps": "Nuts 🌰",
-            "sugar": "Honey 🍯",
-            "butter": "Olive Oil 🥑",
-            "white rice": "Brown Rice 🍚",
-            "chocolate": "Dark Chocolate 🍫",
-            "ice cream": "Frozen Yogurt 🍨",
-            "mayo": "Greek Yogurt 🥣",
-            "candy": "Fresh Fruit 🍎",
-            "cookies": "Oatmeal Cookies 🍪",
-            "burger": "Turkey Burger 🍔",
-            "pizza": "Cauliflower Pizza 🍕"
-        }
+    # --- RULE 2: HEALTHIER ALTERNATIVES ---
+    healthier_options = MappingProxyType({
+        "white bread": "Whole Wheat Bread 🍞",
+        "soda": "Sparkling Water 💧",
+        "coke": "Sparkling Water 💧",
+        "pepsi": "Sparkling Water 💧",
+        "chips": "Popcorn 🍿",
+        "crisps": "Nuts 🌰",
+        "sugar": "Honey 🍯",
+        "butter": "Olive Oil 🥑",
+        "white rice": "Brown Rice 🍚",
+        "chocolate": "Dark Chocolate 🍫",
+        "ice cream": "Frozen Yogurt 🍨",
+        "mayo": "Greek Yogurt 🥣",
+        "candy": "Fresh Fruit 🍎",
+        "cookies": "Oatmeal Cookies 🍪",
+        "burger": "Turkey Burger 🍔",
+        "pizza": "Cauliflower Pizza 🍕"
+    })
+    _alt_match = staticmethod(keyword_matcher(healthier_options))
+    
+    # --- RULE 3: PAIRINGS ---
+    item_pairings = MappingProxyType({
+        "bread": ("Butter", "Jam"),
+        "cereal": ("Milk",),
+        "pasta": ("Pasta Sauce", "Cheese"),
+        "eggs": ("Bread",),
+        "pancakes": ("Syrup",),
+        "coffee": ("Milk", "Sugar")
+    })
+    _pair_match = staticmethod(keyword_matcher(item_pairings))
+
+    def __init__(self):
+        super().__init__()
         
-        # --- RULE 3: PAIRINGS ---
-        self.item_pairings = {
-            "bread": ["Butter", "Jam"],
-            "cereal": ["Milk"],
-            "pasta": ["Pasta Sauce", "Cheese"],
-            "eggs": ["Bread"],
-            "pancakes": ["Syrup"],
-            "coffee": ["Milk", "Sugar"]
-        }
+        self._shelf_life_cache = {}  # item -> days, the rules never change
+        self._alt_cache = {}  # item -> alternative (or None), the rules never change
 
-    def load_data(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r') as f:
-                    self.data = json.load(f)
-            except:
-                self.data = self.default_data()
-        else:
-            self.data = self.default_data()
-    
-    def default_data(self):
-        return {
-            "grocery_list": [], 
-            "purchase_history": [], 
-            "last_purchase": {}
-        }
-    
-    def save_data(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4, default=str)
+    # --- HELPER: SHELF LIFE LOOKUP ---
+    def get_shelf_life(self, item):
+        """Returns the shelf life of the first rule keyword found in the item, or 7 days."""
+        if item not in self._shelf_life_cache:
+            key = self._shelf_life_match(item)
+            self._shelf_life_cache[item] = self.shelf_life_rules[key] if key else 7
+        return self._shelf_life_cache[item]
 
     # --- HELPER: CHECK FOR ALTERNATIVE ---
     def get_healthier_option(self, item):
         """Returns the healthy alternative name if one exists."""
-        for unhealthy_key, alternative in self.healthier_options.items():
-            if unhealthy_key in item.lower():
-                return alternative
-        return None
+        if item not in self._alt_cache:
+            key = self._alt_match(item.lower())
+            self._alt_cache[item] = self.healthier_options[key] if key else None
+        return self._alt_cache[item]
 
     # --- FEATURE: REPLACE ITEM ---
     def replace_item(self, old_item, new_item):
         """Swaps an unhealthy item for a healthy one in the list."""
-        if old_item in self.data["grocery_list"]:
-            index = self.data["grocery_list"].index(old_item)
+        stored = self.list_index.pop(old_item.strip().lower(), None)
+        if stored is not None:
+            index = self.data["grocery_list"].index(stored)
             self.data["grocery_list"][index] = new_item # Replace in place
+            self._list_index[new_item.strip().lower()] = new_item
             self.save_data()
             return f"♻️ Swapped **{old_item}** for **{new_item}**!"
         return "⚠️ Item not found."
@@ -92,9 +98,10 @@ class GroceryAssistant:
     def add_item(self, item):
         item = item.strip().lower()
         if not item: return "❌ Please enter an item name."
-        if item in self.data["grocery_list"]: return f"⚠️ '{item.title()}' is already on your list!"
+        if item in self.list_index: return f"⚠️ '{item.title()}' is already on your list!"
         
         self.data["grocery_list"].append(item)
+        self._list_index[item] = item
         self.save_data()
         
         feedback = [f"✅ Added **{item.title()}** to your list."]
@@ -107,115 +114,165 @@ class GroceryAssistant:
             found_health_tip = True
             
         # Pairing Check
-        for key, pairs in self.item_pairings.items():
-            if key in item:
-                feedback.append(f"🛒 **Don't forget:** {', '.join(pairs)}")
-                break
+        key = self._pair_match(item)
+        if key:
+            feedback.append(f"🛒 **Don't forget:** {', '.join(self.item_pairings[key])}")
 
         return "\n\n".join(feedback), found_health_tip
 
     def record_purchase(self, item, quantity=1):
         item = item.strip().lower()
-        today = datetime.now()
+        today_date = date.today()
+        today = today_date.isoformat()
         
-        days_to_expire = 7 
-        for key, days in self.shelf_life_rules.items():
-            if key in item:
-                days_to_expire = days
-                break
+        days_to_expire = self.get_shelf_life(item)
+        expiry_date = (today_date + timedelta(days=days_to_expire)).isoformat()
         
-        expiry_date = (today + timedelta(days=days_to_expire)).strftime("%Y-%m-%d")
-        
-        self.data["purchase_history"].append({
+        history_df = self.history_df
+        entry = {
             "item": item, 
             "quantity": quantity, 
-            "purchase_date": today.strftime("%Y-%m-%d"),
+            "purchase_date": today,
             "expiry_date": expiry_date
-        })
-        
-        self.data["last_purchase"][item] = today.strftime("%Y-%m-%d")
-        
-        if item in self.data["grocery_list"]: 
-            self.data["grocery_list"].remove(item)
+        }
+        with self.transaction():
+            self.append_history(entry)
+            self.data["last_purchase"][item] = today
+            self.discard_item(item)
+            self.extend_history_df(history_df, entry)
         
-        self.save_data()
         return f"🛍️ Purchased {quantity}x {item.title()} (Expires on {expiry_date})"
 
+    @cached_until_save
     def predict_restock(self):
-        suggestions = []
-        today = datetime.now()
+        last = pd.Series(self.data["last_purchase"], dtype=object)
+        if last.empty: return []
         
-        for item, last_date_str in self.data["last_purchase"].items():
-            if item in self.data["grocery_list"]: continue
-            try:
-                last_date = datetime.strptime(last_date_str, "%Y-%m-%d")
-                days_passed = (today - last_date).days
-                
-                expected_duration = 7
-                for key, days in self.shelf_life_rules.items():
-                    if key in item:
-                        expected_duration = days
-                        break
-                
-                if days_passed >= expected_duration:
-                    suggestions.append({
-                        "item": item,
-                        "days_ago": days_passed,
-                        "reason": f"Bought {days_passed} days ago"
-                    })
-            except: continue
+        # Unparseable dates become NaT, so their NaN day counts fail every comparison
+        days_passed = (pd.Timestamp.now() - pd.to_datetime(last, format="%Y-%m-%d", errors="coerce")).dt.days
+        expected_duration = np.fromiter((self.get_shelf_life(item) for item in last.index), dtype=int, count=len(last))
+        due = (days_passed >= expected_duration) & ~last.index.isin(list(self.list_index))
+        
+        suggestions = []
+        for item, days in days_passed[due].items():
+            suggestions.append({
+                "item": item,
+                "days_ago": int(days),
+                "reason": f"Bought {int(days)} days ago"
+            })
         return suggestions
 
+    @cached_until_save
     def check_expiring_items(self):
-        alerts = []
-        today = datetime.now()
+        df = self.history_df
+        if df.empty: return []
+        
+        days_left = (self.history_expiry - pd.Timestamp.now()).dt.days.to_numpy()
+        expired = days_left < 0
+        critical = (days_left >= 0) & (days_left <= 2)
+        items = df["item"].to_numpy()
         
-        for idx, p in enumerate(self.data["purchase_history"]):
-            if "expiry_date" in p:
-                try:
-                    expiry = datetime.strptime(p["expiry_date"], "%Y-%m-%d")
-                    days_left = (expiry - today).days
-                    
-                    if days_left < 0:
-                        alerts.append({
-                            "type": "expired",
-                            "msg": f"❌ **{p['item'].title()}** expired {abs(days_left)} days ago!"
-                        })
-                    elif 0 <= days_left <= 2:
-                        alerts.append({
-                            "type": "critical",
-                            "item": p['item'],
-                            "id": idx,
-                            "msg": f"⚠️ **{p['item'].title()}** expires in {days_left} days! Plan to use or restock."
-                        })
-                except: continue
+        alerts = []
+        for idx in np.flatnonzero(expired | critical):
+            item, days = items[idx], int(days_left[idx])
+            if expired[idx]:
+                alerts.append({
+                    "type": "expired",
+                    "msg": f"❌ **{item.title()}** expired {abs(days)} days ago!"
+                })
+            else:
+                alerts.append({
+                    "type": "critical",
+                    "item": item,
+                    "id": int(idx),
+                    "msg": f"⚠️ **{item.title()}** expires in {days} days! Plan to use or restock."
+                })
         return alerts
 
+@st.cache_resource(show_spinner=False)
+def get_assistant() -> GroceryAssistant:
+    """Builds the assistant once per process instead of once per session."""
+    return GroceryAssistant()
+
 # ========== STREAMLIT UI ==========
+APP_CSS = """
+<style>
+.main-header { font-size: 2.5rem; color: #2E86AB; text-align: center; } 
+.stButton>button { width: 100%; border-radius: 8px; font-weight: bold;}
+.success-msg { background-color: #d4edda; padding: 15px; border-radius: 10px; color: #155724; border-left: 5px solid #28a745; margin-bottom: 10px;}
+.warning-msg { background-color: #fff3cd; padding: 15px; border-radius: 10px; color: #856404; border-left: 5px solid #ffeeba; margin-bottom: 10px;}
+</style>
+"""
+
+# Button callbacks run before the rerun the click triggers, so no extra st.rerun() is needed
+def add_to_list(assistant, item):
+    assistant.add_item(item)
+
+def restock_item(assistant, item):
+    assistant.add_item(item)
+    st.toast(f"Added {item} to list!")
+
+def flag_restock_change(assistant, before):
+    """Restock Suggestions sit outside the list fragment; ask it for a full rerun only if they changed."""
+    st.session_state.restock_stale = assistant.predict_restock() != before
+
+def remove_from_list(assistant, item):
+    before = assistant.predict_restock()
+    with assistant.transaction():
+        assistant.discard_item(item)
+    flag_restock_change(assistant, before)
+
+def swap_in_list(assistant, item, alt_option):
+    before = assistant.predict_restock()
+    # Toasted from the fragment body; elements drawn in a fragment callback land at the top of the app
+    st.session_state.swap_msg = assistant.replace_item(item, alt_option)
+    flag_restock_change(assistant, before)
+
+@st.fragment
+def render_grocery_list(assistant):
+    """Swap/delete buttons rerun only this fragment, unless the change also affects Restock Suggestions."""
+    if st.session_state.pop("restock_stale", False):
+        st.rerun()
+    if "swap_msg" in st.session_state:
+        st.toast(st.session_state.pop("swap_msg"))
+    st.write(f"**Current List ({len(assistant.data['grocery_list'])}):**")
+    
+    if assistant.data['grocery_list']:
+        for item in assistant.data['grocery_list']:
+            # Check if this item has a healthier alternative
+            alt_option = assistant.get_healthier_option(item)
+            
+            # Layout: Item Name | Swap Button (if unhealthy) | Delete Button
+            if alt_option:
+                c_txt, c_swap, c_del = st.columns([2, 2, 1])
+            else:
+                c_txt, c_del = st.columns([4, 1])
+            
+            c_txt.text(f"• {item.title()}")
+            
+            # If unhealthy, show Swap Button
+            if alt_option:
+                c_swap.button(f"♻️ Swap for {alt_option.split(' ')[0]}", key=f"swap_{item}",
+                              on_click=swap_in_list, args=(assistant, item, alt_option))
+            
+            c_del.button("❌", key=f"del_{item}", on_click=remove_from_list, args=(assistant, item))
+    else:
+        st.caption("Your list is empty.")
+
 def main():
     st.set_page_config(page_title="Rule-Based Grocery Agent", page_icon="🛒", layout="wide")
     
-    st.markdown("""
-    <style>
-    .main-header { font-size: 2.5rem; color: #2E86AB; text-align: center; } 
-    .stButton>button { width: 100%; border-radius: 8px; font-weight: bold;}
-    .success-msg { background-color: #d4edda; padding: 15px; border-radius: 10px; color: #155724; border-left: 5px solid #28a745; margin-bottom: 10px;}
-    .warning-msg { background-color: #fff3cd; padding: 15px; border-radius: 10px; color: #856404; border-left: 5px solid #ffeeba; margin-bottom: 10px;}
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     
     st.markdown("<h1 class='main-header'>🛒 Smart Grocery Assistant</h1>", unsafe_allow_html=True)
    
     
     if 'assistant' not in st.session_state:
-        st.session_state.assistant = GroceryAssistant()
+        st.session_state.assistant = get_assistant()
     
     with st.sidebar:
         st.header("⚙️ System Controls")
-        if st.button("🔄 Reset All Data"):
-            st.session_state.assistant.data = st.session_state.assistant.default_data()
-            st.session_state.assistant.save_data()
-            st.rerun()
+        st.button("🔄 Reset All Data", on_click=st.session_state.assistant.reset_data)
         st.info("System Mode: Rule-Based (Offline)")
 
     col1, col2 = st.columns([2, 1])
@@ -229,9 +286,7 @@ def main():
             for p in predictions:
                 c1, c2 = st.columns([4, 1])
                 c1.write(f"**{p['item'].title()}** ({p['reason']})")
-                if c2.button("Add", key=f"pred_{p['item']}"):
-                    st.session_state.assistant.add_item(p['item'])
-                    st.rerun()
+                c2.button("Add", key=f"pred_{p['item']}", on_click=add_to_list, args=(st.session_state.assistant, p['item']))
         else:
             st.success("✅ No restock suggestions.")
             
@@ -251,35 +306,7 @@ def main():
                     st.markdown(f'<div class="success-msg">{result_text.replace(chr(10), "<br>")}</div>', unsafe_allow_html=True)
 
         # 3. CURRENT LIST WITH SWAP BUTTONS
-        st.write(f"**Current List ({len(st.session_state.assistant.data['grocery_list'])}):**")
-        
-        if st.session_state.assistant.data['grocery_list']:
-            for item in st.session_state.assistant.data['grocery_list']:
-                # Check if this item has a healthier alternative
-                alt_option = st.session_state.assistant.get_healthier_option(item)
-                
-                # Layout: Item Name | Swap Button (if unhealthy) | Delete Button
-                if alt_option:
-                    c_txt, c_swap, c_del = st.columns([2, 2, 1])
-                else:
-                    c_txt, c_del = st.columns([4, 1])
-                
-                c_txt.text(f"• {item.title()}")
-                
-                # If unhealthy, show Swap Button
-                if alt_option:
-                    if c_swap.button(f"♻️ Swap for {alt_option.split(' ')[0]}", key=f"swap_{item}"):
-                        res = st.session_state.assistant.replace_item(item, alt_option)
-                        st.toast(res)
-                        time.sleep(0.5)
-                        st.rerun()
-                
-                if c_del.button("❌", key=f"del_{item}"):
-                    st.session_state.assistant.data["grocery_list"].remove(item)
-                    st.session_state.assistant.save_data()
-                    st.rerun()
-        else:
-            st.caption("Your list is empty.")
+        render_grocery_list(st.session_state.assistant)
 
     with col2:
         # 4. Record Purchase
@@ -290,9 +317,13 @@ def main():
             if st.form_submit_button("✓ Confirm Purchase"):
                 if buy_item:
                     res = st.session_state.assistant.record_purchase(buy_item, buy_qty)
-                    st.success(res)
-                    time.sleep(1)
+                    st.session_state['last_msg'] = res
                     st.rerun()
+        
+        # Shown after the rerun instead of sleeping so the user can read it first
+        if 'last_msg' in st.session_state:
+            st.success(st.session_state['last_msg'])
+            del st.session_state['last_msg']
 
         st.divider()
         # 5. Expiry Alerts
@@ -306,10 +337,7 @@ def main():
                 elif a['type'] == 'critical':
                     c_alert, c_btn = st.columns([3, 1])
                     c_alert.warning(a['msg'])
-                    if c_btn.button("➕ Restock", key=f"restock_{a['id']}"):
-                        st.session_state.assistant.add_item(a['item'])
-                        st.toast(f"Added {a['item']} to list!")
-                        st.rerun()
+                    c_btn.button("➕ Restock", key=f"restock_{a['id']}", on_click=restock_item, args=(st.session_state.assistant, a['item']))
         else:
             st.success("All items are fresh! ✅")
 
@@ -317,8 +345,7 @@ def main():
     with st.expander("📦 View Full Purchase History"):
         hist = st.session_state.assistant.data["purchase_history"]
         if hist:
-            df = pd.DataFrame(hist)
-            st.table(df)
+            st.table(st.session_state.assistant.history_df)
         else:
             st.info("No purchase history yet.")
 
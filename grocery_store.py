@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import atexit
+import weakref
+from datetime import date
+from contextlib import contextmanager
+from functools import wraps
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is used when it's missing
+    orjson = None
+
+# ========== SHARED STORAGE (BOTH APPS) ==========
+# One exit hook for all stores; a WeakSet doesn't keep discarded ones alive like atexit.register(self.flush) would
+_live_stores = weakref.WeakSet()
+
+@atexit.register
+def flush_all():
+    for store in list(_live_stores):
+        store.flush()
+
+def cached_until_save(method):
+    """Memoizes a no-argument method until the next save_data() or the next calendar day."""
+    @wraps(method)
+    def wrapper(self):
+        key = (self._version, date.today())
+        hit = self._result_cache.get(method.__name__)
+        if hit is None or hit[0] != key:
+            hit = self._result_cache[method.__name__] = (key, method(self))
+        return hit[1]
+    return wrapper
+
+class GroceryStore:
+    """grocery_data.json plus the append-only purchase_history.jsonl, with cached DataFrame views
+    and a debounced background save. Both apps' GroceryAssistant build on it."""
+    def __init__(self):
+        self.filename = "grocery_data.json"
+        self.history_log = "purchase_history.jsonl"
+        self._dirty = False
+        self._flush_timer = None
+        self._save_lock = threading.RLock()
+        self._version = 0  # Bumped by save_data; keys the cached_until_save results
+        self._result_cache = {}
+        _live_stores.add(self)
+        self.load_data()
+
+    def load_data(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'rb') as f:
+                    self.data = orjson.loads(f.read()) if orjson else json.load(f)
+            except:
+                self.data = self.default_data()
+        else:
+            self.data = self.default_data()
+        
+        # purchase_history lives in an append-only log; older files kept it inline
+        if os.path.exists(self.history_log):
+            self.data["purchase_history"] = []
+            with open(self.history_log, 'rb') as f:
+                for line in f:
+                    try:
+                        self.data["purchase_history"].append(orjson.loads(line) if orjson else json.loads(line))
+                    except ValueError:
+                        continue  # Blank or torn line
+        else:
+            self.data.setdefault("purchase_history", [])
+            self.write_history_log(self.data["purchase_history"])
+        
+        self._list_index, self._list_src = {}, None
+        self._history_df, self._history_src = None, None
+        self._expiry_dt, self._expiry_src = None, None
+    
+    def default_data(self):
+        return {
+            "grocery_list": [], 
+            "purchase_history": [], 
+            "last_purchase": {}
+        }
+    
+    @property
+    def history_df(self):
+        """purchase_history as a DataFrame, rebuilt only when the list is replaced or edited elsewhere."""
+        hist = self.data["purchase_history"]
+        if self._history_src is not hist or len(self._history_df) != len(hist):
+            self._history_df, self._history_src = pd.DataFrame(hist), hist
+        return self._history_df
+
+    @property
+    def history_expiry(self):
+        """history_df's expiry_date as datetime64, parsed once per history version (NaT for non-dates)."""
+        df = self.history_df
+        if self._expiry_src is not df:
+            col = df["expiry_date"] if "expiry_date" in df else pd.Series(index=df.index, dtype=object)
+            self._expiry_dt, self._expiry_src = pd.to_datetime(col, format="%Y-%m-%d", errors="coerce"), df
+        return self._expiry_dt
+
+    @property
+    def list_index(self):
+        """Normalized name -> stored name for grocery_list, O(1) case-insensitive membership.
+        Rebuilt if the list is replaced or edited elsewhere."""
+        lst = self.data["grocery_list"]
+        if self._list_src is not lst or len(self._list_index) != len(lst):
+            self._list_index, self._list_src = {v.strip().lower(): v for v in lst}, lst
+        return self._list_index
+
+    def discard_item(self, item):
+        """Removes item from the grocery list if present (caller saves). Returns True if removed."""
+        stored = self.list_index.pop(item.strip().lower(), None)
+        if stored is None: return False
+        self.data["grocery_list"].remove(stored)
+        return True
+
+    @staticmethod
+    def history_line(entry):
+        return orjson.dumps(entry, default=str) + b"\n" if orjson else (json.dumps(entry, default=str) + "\n").encode()
+
+    def write_history_log(self, entries):
+        with open(self.history_log, 'wb') as f:
+            f.write(b"".join(self.history_line(e) for e in entries))
+
+    def append_history(self, entry):
+        """Records a purchase in memory and appends it to the log (O(1) disk write)."""
+        with open(self.history_log, 'ab') as f:
+            f.write(self.history_line(entry))
+        self.data["purchase_history"].append(entry)
+
+    def reset_data(self):
+        """Clears all state, including the purchase log."""
+        with self.transaction():
+            self.data = self.default_data()
+            self.write_history_log([])
+
+    def extend_history_df(self, history_df, entry):
+        """Appends entry's row to the cached frame and parses only its expiry date, not the whole column."""
+        self._history_df = pd.concat([history_df, pd.DataFrame([entry])], ignore_index=True)
+        if self._expiry_src is history_df:
+            new_expiry = pd.to_datetime(pd.Series([entry["expiry_date"]], index=[len(history_df)]),
+                                        format="%Y-%m-%d", errors="coerce")
+            self._expiry_dt = pd.concat([self._expiry_dt, new_expiry]) if len(history_df) else new_expiry
+            self._expiry_src = self._history_df
+
+    def save_data(self):
+        """Marks data dirty; a background timer writes it out at most once per second."""
+        with self._save_lock:
+            self._version += 1
+            self._dirty = True
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(1.0, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    @contextmanager
+    def transaction(self):
+        """Groups several mutations so the background flush never writes a half-applied change."""
+        with self._save_lock:
+            yield
+        self.save_data()
+
+    def flush(self):
+        """Runs on the timer thread: writes state to a temp file, then swaps it in."""
+        with self._save_lock:
+            self._flush_timer = None
+            if not self._dirty: return
+            self._dirty = False
+            tmp = self.filename + ".tmp"
+            # History is persisted by append_history, so only the small state dict is rewritten
+            state = {k: v for k, v in self.data.items() if k != "purchase_history"}
+            try:
+                if orjson:
+                    with open(tmp, 'wb') as f:
+                        f.write(orjson.dumps(state, default=str, option=orjson.OPT_INDENT_2))
+                else:
+                    with open(tmp, 'w') as f:
+                        f.write(json.dumps(state, indent=4, default=str))
+                os.replace(tmp, self.filename)
+            except Exception as e:
+                self._dirty = True  # Retry on the next save
+                print(f"Save Error: {e}")